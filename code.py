@@ -1,75 +1,245 @@
+import gc
 import time
 import board
 import busio
 import digitalio
-import adafruit_veml7700
+import supervisor
+from micropython import const
+
+# Collect garbage at a fixed point in the main loop instead of letting an
+# automatic sweep land at an arbitrary moment
+gc.disable()
+
+# Print lux and Bortle readings to the serial console every loop. Being a
+# const(), the compiler drops the debug block entirely when this is 0.
+DEBUG = const(0)
+
+# VEML7700 is driven directly over I2C rather than through the
+# adafruit_veml7700 driver, which saves the RAM its register objects use
+VEML7700_ADDR = const(0x10)
+# ALS_CONF register 0x00 = 0x0000: gain x1, 100 ms integration,
+# interrupts off, sensor powered on
+ALS_CONF = b"\x00\x00\x00"
+# ALS output register, read into one shared buffer every loop
+ALS_REG = b"\x04"
+ALS_BUF = bytearray(2)
+# Lux per count at gain x1 / 100 ms (0.0036 at gain x2 / 800 ms)
+ALS_RESOLUTION = 0.0576
+
+# Function to set up I2C and configure the VEML7700. code.py is the only
+# user of the bus, so the lock is taken once here and held for good.
+def initialize_sensor():
+    # VEML7700 supports 400 kHz Fast mode; the busio default is 100 kHz
+    i2c = busio.I2C(board.GP1, board.GP0, frequency=400_000)
+    try:
+        while not i2c.try_lock():
+            pass
+        i2c.writeto(VEML7700_ADDR, ALS_CONF)
+    except Exception:
+        i2c.deinit()
+        raise
+    return i2c
+
+# Consecutive failed reads before the bus and sensor are re-created
+MAX_SENSOR_ERRORS = const(5)
+
+# Function to recover a wedged sensor by tearing down and re-creating the
+# I2C bus; returns the new bus, or None if the sensor still doesn't answer
+def reset_sensor(i2c):
+    if i2c is not None:
+        i2c.deinit()
+    try:
+        return initialize_sensor()
+    except Exception:
+        return None
 
-# Setup I2C for the VEML7700
 try:
-    i2c = busio.I2C(board.GP1, board.GP0)
-    veml7700 = adafruit_veml7700.VEML7700(i2c)
+    i2c = initialize_sensor()
 except Exception as e:
     print(f"Error initializing I2C or VEML7700: {e}")
-    veml7700 = None  # Continue without the sensor
+    i2c = None  # Continue without the sensor
 
-# Setup LEDs with a dictionary for easier management
-led_pins = {
-    "green": board.GP2,
-    "yellow": board.GP4,
-    "red": board.GP3,
-}
+# LED pins, in the (green, yellow, red) order initialize_leds() returns
+led_pins = (
+    ("green", board.GP2),
+    ("yellow", board.GP4),
+    ("red", board.GP3),
+)
 
-leds = {}
-for color, pin in led_pins.items():
+# Function to set up the LEDs; returns (green, yellow, red), with None
+# for any LED that failed to initialize
+def initialize_leds():
+    leds = []
+    for color, pin in led_pins:
+        try:
+            led = digitalio.DigitalInOut(pin)
+            led.direction = digitalio.Direction.OUTPUT
+        except Exception as e:
+            print(f"Error initializing {color} LED on pin {pin}: {e}")
+            led = None
+        leds.append(led)
+    return tuple(leds)
+
+led_green, led_yellow, led_red = initialize_leds()
+
+# GPIO bit masks for the LED pins above
+LED_MASK_GREEN = const(1 << 2)   # GP2
+LED_MASK_YELLOW = const(1 << 4)  # GP4
+LED_MASK_RED = const(1 << 3)     # GP3
+LED_MASK_ALL = const(LED_MASK_GREEN | LED_MASK_YELLOW | LED_MASK_RED)
+
+# RP2040 SIO GPIO_OUT_SET / GPIO_OUT_CLR registers
+SIO_GPIO_OUT_SET = 0xD0000014
+SIO_GPIO_OUT_CLR = 0xD0000018
+
+# Register payloads (set word, clear word) for each LED band
+def led_words(on_mask):
+    return (on_mask.to_bytes(4, "little"),
+            (LED_MASK_ALL & ~on_mask).to_bytes(4, "little"))
+
+LED_WORDS_GREEN = led_words(LED_MASK_GREEN)
+LED_WORDS_YELLOW = led_words(LED_MASK_YELLOW)
+LED_WORDS_RED = led_words(LED_MASK_RED)
+
+# The DigitalInOut objects keep ownership of the pins, but once all three
+# are outputs the LEDs can be switched with one SET and one CLR store
+# instead of three digitalio writes. Fall back to digitalio otherwise.
+sio_out_set = None
+sio_out_clr = None
+if led_green is not None and led_yellow is not None and led_red is not None:
     try:
-        led = digitalio.DigitalInOut(pin)
-        led.direction = digitalio.Direction.OUTPUT
-        leds[color] = led
+        import memorymap
+        sio_out_set = memorymap.AddressRange(start=SIO_GPIO_OUT_SET, length=4)
+        sio_out_clr = memorymap.AddressRange(start=SIO_GPIO_OUT_CLR, length=4)
     except Exception as e:
-        print(f"Error initializing {color} LED on pin {pin}: {e}")
+        print(f"Direct LED register access unavailable, using digitalio: {e}")
+        sio_out_set = None
+        sio_out_clr = None
+
+# Upper lux bound for Bortle classes 1-8; anything brighter is class 9
+BORTLE_THRESHOLDS = (0.01, 0.08, 0.3, 1.0, 4.0, 10.0, 30.0, 100.0)
+
+# supervisor.ticks_ms() wraps every 2**29 ms, so deadlines are compared
+# modulo that period
+TICKS_PERIOD = const(1 << 29)
+TICKS_MAX = const(TICKS_PERIOD - 1)
+TICKS_HALFPERIOD = const(TICKS_PERIOD // 2)
+
+# Function to get the signed difference ticks1 - ticks2 in milliseconds
+def ticks_diff(ticks1, ticks2):
+    diff = (ticks1 - ticks2) & TICKS_MAX
+    return ((diff + TICKS_HALFPERIOD) & TICKS_MAX) - TICKS_HALFPERIOD
 
 # Function to map lux value to Bortle scale
 def get_bortle_scale(lux):
-    thresholds = [
-        (0.01, 1), (0.08, 2), (0.3, 3),
-        (1.0, 4), (4.0, 5), (10.0, 6),
-        (30.0, 7), (100.0, 8)
-    ]
-    for threshold, scale in thresholds:
+    scale = 1
+    for threshold in BORTLE_THRESHOLDS:
         if lux < threshold:
             return scale
-    return 9
+        scale += 1
+    return scale
 
 # Function to update LEDs based on Bortle scale
-def update_leds(bortle_scale):
-    led_states = {
-        "green": bortle_scale <= 3,
-        "yellow": 4 <= bortle_scale <= 5,
-        "red": bortle_scale >= 6,
-    }
-    for color, state in led_states.items():
-        if color in leds:
-            leds[color].value = state
-
-while True:
-    try:
+def update_leds(bortle_scale, green, yellow, red):
+    if sio_out_set is not None:
+        if bortle_scale <= 3:
+            words = LED_WORDS_GREEN
+        elif bortle_scale <= 5:
+            words = LED_WORDS_YELLOW
+        else:
+            words = LED_WORDS_RED
+        sio_out_set[0:4] = words[0]
+        sio_out_clr[0:4] = words[1]
+        return
+
+    if bortle_scale <= 3:
+        green_on, yellow_on, red_on = True, False, False
+    elif bortle_scale <= 5:
+        green_on, yellow_on, red_on = False, True, False
+    else:
+        green_on, yellow_on, red_on = False, False, True
+    if green is not None:
+        green.value = green_on
+    if yellow is not None:
+        yellow.value = yellow_on
+    if red is not None:
+        red.value = red_on
+
+# Main loop; hot globals are bound to locals once, since local lookups
+# are much cheaper than global ones on CircuitPython
+def main():
+    bus = i2c
+    # The bus's read method, re-bound whenever the bus is re-created
+    read_als = bus.writeto_then_readfrom if bus is not None else None
+    resolution = ALS_RESOLUTION
+    als_reg = ALS_REG
+    als_buf = ALS_BUF
+    bortle_from_lux = get_bortle_scale
+    set_leds = update_leds
+    green, yellow, red = led_green, led_yellow, led_red
+    sleep = time.sleep
+    ticks_ms = supervisor.ticks_ms
+    deadline_diff = ticks_diff
+    collect = gc.collect
+    error_count = 0
+    sensor_errors = 0
+    last_scale = -1  # Forces the first LED update
+    next_deadline = ticks_ms()
+
+    while True:
         # Read ambient light level in lux
-        if veml7700:
-            lux = veml7700.lux
+        lux = -1  # Fallback value when sensor is not initialized
+        if read_als is not None:
+            try:
+                # One ALS register read into the shared buffer
+                read_als(VEML7700_ADDR, als_reg, als_buf)
+                lux = (als_buf[0] | (als_buf[1] << 8)) * resolution
+                sensor_errors = 0
+            except OSError as e:
+                lux = None  # Leave the LEDs showing the last good reading
+                sensor_errors += 1
+                # Only every tenth error is printed so a flaky sensor
+                # doesn't flood the serial console
+                error_count += 1
+                if error_count % 10 == 1:
+                    print("Error reading VEML7700 (%d total): %s" % (error_count, e))
         else:
-            lux = -1  # Fallback value when sensor is not initialized
-        print(f"Lux: {lux:.2f}" if lux >= 0 else "Lux: Sensor unavailable")
-        
-        # Determine Bortle scale
-        bortle_scale = get_bortle_scale(lux) if lux >= 0 else 9
-        print(f"Bortle Scale: {bortle_scale}")
-        
-        # Update LEDs based on Bortle scale
-        update_leds(bortle_scale)
+            sensor_errors += 1
 
-    except Exception as e:
-        # Log the error and continue
-        print(f"Error during main loop: {e}")
+        # A sensor that keeps failing is usually wedged; re-create the bus
+        # and re-initialize it, retrying every MAX_SENSOR_ERRORS loops
+        if sensor_errors >= MAX_SENSOR_ERRORS:
+            bus = reset_sensor(bus)
+            read_als = bus.writeto_then_readfrom if bus is not None else None
+            sensor_errors = 0
+
+        if lux is not None:
+            # Determine Bortle scale
+            bortle_scale = bortle_from_lux(lux) if lux >= 0 else 9
+
+            if DEBUG:
+                if lux >= 0:
+                    print("Lux: %.2f  Bortle Scale: %d" % (lux, bortle_scale))
+                else:
+                    print("Lux: Sensor unavailable  Bortle Scale: %d" % bortle_scale)
+
+            # Update LEDs only when the Bortle scale changes
+            if bortle_scale != last_scale:
+                set_leds(bortle_scale, green, yellow, red)
+                last_scale = bortle_scale
+
+        # Collect every loop, just before sleeping, so the pause is absorbed
+        # by the idle window and the heap never builds up fragments
+        collect()
+
+        # Sleep until the next one-second deadline, so the time spent
+        # reading and updating doesn't stretch the sampling period. If we
+        # are already past it, resynchronize rather than run back-to-back.
+        next_deadline = (next_deadline + 1000) & TICKS_MAX
+        delay = deadline_diff(next_deadline, ticks_ms())
+        if delay > 0:
+            sleep(delay / 1000)
+        else:
+            next_deadline = ticks_ms()
 
-    # Wait for a second before reading again
-    time.sleep(1)
+main()
@@ -1,4 +1,5 @@
 import time
+from bisect import bisect_right
 import board
 import busio
 import digitalio
@@ -16,26 +17,12 @@ led_red.direction = digitalio.Direction.OUTPUT
 led_yellow = digitalio.DigitalInOut(board.D22) # GPIO 22 (Pin 15)
 led_yellow.direction = digitalio.Direction.OUTPUT
 
+# Upper lux bound for Bortle classes 1-8; anything brighter is class 9
+BORTLE_THRESHOLDS = (0.01, 0.08, 0.3, 1.0, 4.0, 10.0, 30.0, 100.0)
+
 # Function to map lux value to Bortle scale
 def get_bortle_scale(lux):
-    if lux < 0.01:
-        return 1
-    elif lux < 0.08:
-        return 2
-    elif lux < 0.3:
-        return 3
-    elif lux < 1.0:
-        return 4
-    elif lux < 4.0:
-        return 5
-    elif lux < 10:
-        return 6
-    elif lux < 30:
-        return 7
-    elif lux < 100:
-        return 8
-    else:
-        return 9
+    return bisect_right(BORTLE_THRESHOLDS, lux) + 1
 
 while True:
     # Read ambient light level in lux